@@ -101,6 +101,7 @@
 #define STREAM_MOVE         0x0A
 #define STREAM_FILE_EXISTS  0x0B
 #define STREAM_REALPATH     0x0C
+#define STREAM_FILE_EDIT    0x0D
 
 /* EXEC channels */
 #define CHAN_STDOUT         0x01
@@ -133,6 +134,14 @@
 /* HELLO flags */
 #define FLAG_RESUME         0x01
 #define FLAG_SIMPLE         0x02
+#define FLAG_CAP_EDIT       0x04    /* We handle STREAM_FILE_EDIT */
+#define FLAG_CAP_WRITE_EXCL 0x08    /* We honor FILE_WRITE exclusive flag */
+
+/* FILE_EDIT flags */
+#define EDIT_REPLACE_ALL    0x01
+
+/* FILE_WRITE flags */
+#define WRITE_EXCLUSIVE     0x01    /* Fail with ERR_EXISTS if path exists */
 
 /* GOODBYE reasons */
 #define BYE_NORMAL          0x00
@@ -942,6 +951,8 @@ static int send_hello()
 
     if (resume_mode) flags |= FLAG_RESUME;
     if (simple_mode) flags |= FLAG_SIMPLE;
+    flags |= FLAG_CAP_EDIT;
+    flags |= FLAG_CAP_WRITE_EXCL;
 
     /* Get current working directory */
 #ifdef NEXT_COMPAT
@@ -1148,22 +1159,48 @@ char *path;
     free_stream(s);
 }
 
-static void handle_file_write(s, path, mode)
+static void handle_file_write(s, path, mode, flags)
 struct stream *s;
 char *path;
 int mode;
+int flags;
 {
+    int fd, err;
+
     if (mode == 0) mode = 0644;
 
-    s->file_fp = fopen(path, "wb");
-    if (!s->file_fp) {
-        send_stream_error(s->id, ERR_NOT_FOUND, strerror(errno));
-        free_stream(s);
-        return;
-    }
+    if (flags & WRITE_EXCLUSIVE) {
+        /* Existence check and create in one step */
+        fd = open(path, O_WRONLY | O_CREAT | O_EXCL, mode);
+        if (fd < 0) {
+            send_stream_error(s->id, errno == EEXIST ? ERR_EXISTS : ERR_NOT_FOUND,
+                              strerror(errno));
+            free_stream(s);
+            return;
+        }
+        /* Exact mode, not reduced by the umask, as chmod() gives below */
+        fchmod(fd, mode);
+        s->file_fp = fdopen(fd, "wb");
+        if (!s->file_fp) {
+            /* Don't leave behind the empty file we just created */
+            err = errno;
+            close(fd);
+            unlink(path);
+            send_stream_error(s->id, ERR_NO_MEMORY, strerror(err));
+            free_stream(s);
+            return;
+        }
+    } else {
+        s->file_fp = fopen(path, "wb");
+        if (!s->file_fp) {
+            send_stream_error(s->id, ERR_NOT_FOUND, strerror(errno));
+            free_stream(s);
+            return;
+        }
 
-    /* Set permissions */
-    chmod(path, mode);
+        /* Set permissions */
+        chmod(path, mode);
+    }
 
     /* Stream is now open, data will come via STREAM_DATA packets */
     /* Don't free_stream - wait for STREAM_END from relay */
@@ -1773,6 +1810,182 @@ char *pattern;
     free_stream(s);
 }
 
+/* ============================================================================
+ * File Edit (search and replace in place)
+ *
+ * Reads the whole file, counts non-overlapping matches of the old bytes,
+ * and rewrites the file only when the edit is unambiguous: exactly one
+ * match, or any number with EDIT_REPLACE_ALL. Saves sending the file to
+ * the relay and back. The match count is returned in STREAM_END.
+ * ============================================================================ */
+
+static void handle_file_edit(s, path, meta, metalen)
+struct stream *s;
+char *path;
+unsigned char *meta;    /* flags(1) + old_len(4) + old + new_len(4) + new */
+int metalen;
+{
+    struct stat st;
+    FILE *fp;
+    char *text, *end, *p, *match, *old, *repl;
+    unsigned long old_len, repl_len, count;
+    unsigned char endbuf[9];
+    char target[MAX_PATH], tmp[MAX_PATH];
+    int flags, failed, fd, err, in_place, skip[256];
+    long size;
+
+    if (metalen < 9) {
+        send_stream_error(s->id, ERR_INVALID, "Invalid edit request");
+        free_stream(s);
+        return;
+    }
+    flags = meta[0];
+    old_len = get_u32(meta + 1);
+    if (old_len == 0 || old_len > (unsigned long)(metalen - 9)) {
+        send_stream_error(s->id, ERR_INVALID, "Invalid edit request");
+        free_stream(s);
+        return;
+    }
+    old = (char *)meta + 5;
+    repl_len = get_u32(meta + 5 + old_len);
+    if (repl_len > (unsigned long)(metalen - 9) - old_len) {
+        send_stream_error(s->id, ERR_INVALID, "Invalid edit request");
+        free_stream(s);
+        return;
+    }
+    repl = (char *)meta + 9 + old_len;
+
+    if (stat(path, &st) < 0) {
+        send_stream_error(s->id, ERR_NOT_FOUND, strerror(errno));
+        free_stream(s);
+        return;
+    }
+    if (S_ISDIR(st.st_mode)) {
+        send_stream_error(s->id, ERR_IS_DIR, "Is a directory");
+        free_stream(s);
+        return;
+    }
+
+    text = malloc((size_t)st.st_size + 1);
+    if (!text) {
+        send_stream_error(s->id, ERR_NO_MEMORY, "File too large to edit");
+        free_stream(s);
+        return;
+    }
+
+    fp = fopen(path, "rb");
+    if (!fp) {
+        send_stream_error(s->id, ERR_NOT_FOUND, strerror(errno));
+        free(text);
+        free_stream(s);
+        return;
+    }
+    size = fread(text, 1, (size_t)st.st_size, fp);
+    fclose(fp);
+    end = text + size;
+
+    /* Count matches */
+    bm_build_skip(old, (int)old_len, skip);
+    count = 0;
+    p = text;
+    while ((match = bm_search(p, (int)(end - p), old, (int)old_len, skip)) != NULL) {
+        count++;
+        p = match + old_len;
+    }
+
+    /* Rewrite only if unambiguous; otherwise the relay reports the count */
+    if (count == 1 || (count > 1 && (flags & EDIT_REPLACE_ALL))) {
+        /*
+         * Write the result to a temp file next to the target and rename it
+         * over the original, so a failed write never leaves a truncated
+         * file. Edit the file a symlink points at, not the link itself.
+         */
+        if (realpath(path, target) == NULL) {
+            send_stream_error(s->id, ERR_NOT_FOUND, strerror(errno));
+            free(text);
+            free_stream(s);
+            return;
+        }
+        if (strlen(target) + 8 > sizeof(tmp)) {
+            send_stream_error(s->id, ERR_INVALID, "Path too long");
+            free(text);
+            free_stream(s);
+            return;
+        }
+        if (access(target, W_OK) < 0) {
+            send_stream_error(s->id, ERR_PERMISSION, strerror(errno));
+            free(text);
+            free_stream(s);
+            return;
+        }
+
+        /*
+         * A rename would split hard links and give the file our owner and
+         * group, and needs a writable directory; in those cases rewrite
+         * the file in place as before.
+         */
+        fd = -1;
+        if (st.st_nlink == 1 && st.st_uid == geteuid() && st.st_gid == getegid()) {
+            strcpy(tmp, target);
+            strcat(tmp, ".XXXXXX");
+            fd = mkstemp(tmp);
+            if (fd < 0 && errno != EACCES) {
+                send_stream_error(s->id, ERR_PERMISSION, strerror(errno));
+                free(text);
+                free_stream(s);
+                return;
+            }
+        }
+        in_place = fd < 0;
+        if (in_place) {
+            fp = fopen(target, "wb");
+            if (!fp) {
+                send_stream_error(s->id, ERR_PERMISSION, strerror(errno));
+                free(text);
+                free_stream(s);
+                return;
+            }
+        } else {
+            fchmod(fd, st.st_mode & 07777);
+            fp = fdopen(fd, "wb");
+            if (!fp) {
+                err = errno;
+                close(fd);
+                unlink(tmp);
+                send_stream_error(s->id, ERR_NO_MEMORY, strerror(err));
+                free(text);
+                free_stream(s);
+                return;
+            }
+        }
+        p = text;
+        while ((match = bm_search(p, (int)(end - p), old, (int)old_len, skip)) != NULL) {
+            fwrite(p, 1, match - p, fp);
+            fwrite(repl, 1, repl_len, fp);
+            p = match + old_len;
+        }
+        fwrite(p, 1, end - p, fp);
+        failed = ferror(fp);
+        if (fclose(fp) != 0) failed = 1;
+        if (!failed && !in_place && rename(tmp, target) < 0) failed = 1;
+        if (failed) {
+            err = errno;
+            if (!in_place) unlink(tmp);
+            send_stream_error(s->id, ERR_IO_ERROR, strerror(err));
+            free(text);
+            free_stream(s);
+            return;
+        }
+    }
+    free(text);
+
+    put_u32(endbuf, s->id);
+    endbuf[4] = STATUS_OK;
+    put_u32(endbuf + 5, count);
+    send_packet(PKT_STREAM_END, endbuf, 9);
+    free_stream(s);
+}
+
 /* ============================================================================
  * Directory Listing
  * ============================================================================ */
@@ -2004,7 +2217,7 @@ int length;
     struct stream *s;
     char *path, *newpath;
     unsigned char *path_end;
-    int mode;
+    int mode, flags;
 
     if (length < 5) return;
 
@@ -2043,12 +2256,16 @@ int length;
             break;
 
         case STREAM_FILE_WRITE:
-            /* path(string) + mode(uint16) */
+            /* path(string) + mode(uint16) [+ flags(uint8)] */
             mode = 0;
+            flags = 0;
             if (path_end + 2 <= payload + length) {
                 mode = get_u16(path_end);
             }
-            handle_file_write(s, path, mode);
+            if (path_end + 3 <= payload + length) {
+                flags = path_end[2];
+            }
+            handle_file_write(s, path, mode, flags);
             break;
 
         case STREAM_EXEC:
@@ -2095,6 +2312,11 @@ int length;
             handle_realpath(s, path);
             break;
 
+        case STREAM_FILE_EDIT:
+            /* path(string) + flags(uint8) + old(uint32 + bytes) + new(uint32 + bytes) */
+            handle_file_edit(s, path, path_end, (int)(payload + length - path_end));
+            break;
+
         case STREAM_FILE_FIND:
             /* path(string) + pattern(string) - validate second string */
             newpath = safe_string(payload, path_end - payload, length, NULL);
@@ -2155,20 +2377,19 @@ int length;
 
     if (length < 4) return;
 
+    /* Acknowledge received data for flow control, even for a stream
+     * that already failed, or the relay's send window leaks */
+    bytes_to_ack += length;
+
     stream_id = get_u32(payload);
     s = find_stream(stream_id);
     if (!s) {
         if (logfile) fprintf(logfile, "[WARN] Data for unknown stream %lu\n", stream_id);
-        return;
-    }
-
-    if (s->type == STREAM_FILE_WRITE) {
+    } else if (s->type == STREAM_FILE_WRITE) {
         handle_file_write_data(s, payload + 4, length - 4);
     }
     /* Other stream types don't receive data from relay */
 
-    /* Acknowledge received data for flow control */
-    bytes_to_ack += length;
     send_window_update();
 }
 
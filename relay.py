@@ -10,17 +10,35 @@ MCP-only relay for v2 binary protocol.
 
 import argparse
 import asyncio
+import datetime
+import functools
+import itertools
 import json
 import os
+import posixpath
 import pty
+import resource
 import signal
+import socket
 import struct
-import sys
 import fcntl
 import termios
 import secrets
+import time
+import urllib.error
+import urllib.request
 from typing import Optional, Dict, Any, List, Tuple
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # =============================================================================
 # Protocol Constants
 # =============================================================================
@@ -59,10 +77,19 @@ STREAM_REMOVE = 0x09
 STREAM_MOVE = 0x0A
 STREAM_FILE_EXISTS = 0x0B
 STREAM_REALPATH = 0x0C
+STREAM_FILE_EDIT = 0x0D
 
 # HELLO flags
 FLAG_RESUME = 0x01
 FLAG_SIMPLE = 0x02
+FLAG_CAP_EDIT = 0x04        # Client handles FILE_EDIT streams
+FLAG_CAP_WRITE_EXCL = 0x08  # Client honors the FILE_WRITE exclusive flag
+
+# FILE_EDIT flags
+EDIT_REPLACE_ALL = 0x01
+
+# FILE_WRITE flags
+WRITE_EXCLUSIVE = 0x01      # Fail with ERR_EXISTS if the path exists
 
 # GOODBYE reasons
 GOODBYE_NORMAL = 0x00
@@ -89,9 +116,21 @@ ERR_UNKNOWN = 0xFF
 
 # Limits
 MAX_PAYLOAD = 16 * 1024 * 1024  # 16 MB
+CLIENT_MAX_PACKET = 1024 * 1024 # Largest packet the client accepts
 DEFAULT_WINDOW = 256 * 1024     # 256 KB
 CHUNK_SIZE = 64 * 1024          # 64 KB
 WINDOW_UPDATE_THRESHOLD = 8192  # Send WINDOW_UPDATE every 8KB
+MAX_STREAMS = 256               # Client's concurrent stream limit
+SMALL_PACKET = 64               # Concatenate header and payload below this size
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024  # 4 MB (kernel clamps to net.core.[rw]mem_max)
+MCP_WRITE_HIGH_WATER = 1024 * 1024    # Only wait for MCP responses to drain past 1 MB
+MCP_IDLE_TIMEOUT = 30           # Close keep-alive MCP connections idle this long (seconds)
+PTY_BUFFER_LIMIT = 4 * CHUNK_SIZE  # Stop reading the PTY when this much output is unsent
+MAX_LINE_LENGTH = 2000          # read_file truncates longer lines
+FS_CACHE_TTL = 2.0              # Seconds list_directory/file_info results stay cached
+FS_CACHE_MAX = 1024             # Cached results kept before the cache is flushed
+SINK_BUFFER_LIMIT = 4 * CHUNK_SIZE  # Upload data queued for the host file before the dispatcher waits
+REAP_TIMEOUT = 5                # Seconds Claude gets to exit after SIGTERM before SIGKILL
 
 # MCP Constants
 MCP_PROTOCOL_VERSION = "2024-11-05"
@@ -110,7 +149,7 @@ MCP_TOOLS = [
             "type": "object",
             "properties": {
                 "path": {"type": "string", "description": "Path to the file to read"},
-                "offset": {"type": "integer", "description": "Line number to start from (0-based). Default: 0"},
+                "offset": {"type": "integer", "minimum": 0, "description": "Line number to start from (0-based). Default: 0"},
                 "limit": {"type": "integer", "description": "Maximum lines to read. Default: 2000"}
             },
             "required": ["path"]
@@ -301,13 +340,46 @@ MCP_TOOLS = [
     }
 ]
 
+# Static MCP results never change, so serialize them once
+MCP_TOOLS_RESULT = json.dumps({"tools": MCP_TOOLS}, separators=(',', ':')).encode('utf-8')
+MCP_INITIALIZE_RESULT = json.dumps({
+    "protocolVersion": MCP_PROTOCOL_VERSION,
+    "capabilities": {"tools": {}},
+    "serverInfo": {"name": MCP_SERVER_NAME, "version": MCP_SERVER_VERSION}
+}, separators=(',', ':')).encode('utf-8')
+MCP_EMPTY_RESULT = b'{}'
+MCP_EMPTY_PARAMS: Dict[str, Any] = {}   # Shared default for missing params; never mutated
+
+# Tools that leave the remote filesystem alone; any other call flushes the cache
+READ_ONLY_TOOLS = frozenset({
+    'get_cwd', 'read_file', 'list_directory', 'file_info', 'file_exists',
+    'search_files', 'find_files', 'upload_to_host', 'list_host_directory',
+})
+
+# Entry type bytes, keyed as ints so parsers never build a str per entry
+FILE_TYPE_NAMES = {ord('f'): 'file', ord('d'): 'directory', ord('l'): 'symlink'}
+DIR_ENTRY_SUFFIX = {ord('d'): '/', ord('l'): '@'}
+
+# Constant start of every 200 response; Content-Length and the session follow
+HTTP_JSON_HEAD_KEEP_ALIVE = (b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nConnection: keep-alive\r\n"
+                             b"Keep-Alive: timeout=%d\r\n" % MCP_IDLE_TIMEOUT)
+HTTP_JSON_HEAD_CLOSE = b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nConnection: close\r\n"
+
 # =============================================================================
 # Packet Encoding/Decoding
 # =============================================================================
 
-def encode_packet(pkt_type: int, payload: bytes) -> bytes:
-    """Encode a v2 packet: type(1) + length(4) + payload."""
-    return struct.pack('>BI', pkt_type, len(payload)) + payload
+# Compiled once; unpack_from reads fields in place without slicing
+PACKET_HEADER = struct.Struct('>BI')   # type(1) + length(4)
+UINT32 = struct.Struct('>I')
+INT32 = struct.Struct('>i')
+RESIZE = struct.Struct('>HH')          # TERM_RESIZE rows + cols
+FILE_STAT = struct.Struct('>BBIQQ')    # exists, type, mode, size, mtime
+
+
+def encode_header(pkt_type: int, length: int) -> bytes:
+    """Encode a v2 packet header: type(1) + length(4)."""
+    return PACKET_HEADER.pack(pkt_type, length)
 
 
 def encode_string(s: str) -> bytes:
@@ -317,18 +389,170 @@ def encode_string(s: str) -> bytes:
 
 def decode_string(data: bytes, offset: int = 0) -> Tuple[str, int]:
     """Decode null-terminated string, return (string, new_offset)."""
-    try:
-        end = data.index(b'\0', offset)
-    except ValueError:
+    end = data.find(b'\0', offset)
+    if end < 0:
         # No null terminator found - treat rest of data as string
         return data[offset:].decode('utf-8', errors='replace'), len(data)
     return data[offset:end].decode('utf-8', errors='replace'), end + 1
 
 
+# =============================================================================
+# JSON Encoding/Decoding
+# =============================================================================
+
+def json_dumps(obj: Any) -> bytes:
+    """Serialize to UTF-8 JSON bytes."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # orjson rejects lone surrogates (e.g. undecodable host file
+            # names); the stdlib encoder escapes them
+            pass
+    return json.dumps(obj).encode('utf-8')
+
+
+json_loads = orjson.loads if orjson is not None else json.loads
+
+
+# =============================================================================
+# HTTP Parsing
+# =============================================================================
+
+def parse_http_head(head: bytes) -> Optional[Tuple[str, str, str, Dict[str, str]]]:
+    """Parse HTTP request line and headers, return (method, path, version, headers)."""
+    lines = head.decode('latin-1').split('\r\n')
+    parts = lines[0].split(' ')
+    if len(parts) < 2:
+        return None
+    version = parts[2] if len(parts) > 2 else 'HTTP/1.0'
+
+    headers = {}
+    for line in lines[1:]:
+        k, sep, v = line.partition(':')
+        if sep:
+            headers[k.strip().lower()] = v.strip()
+    return parts[0], parts[1], version, headers
+
+
+def encode_jsonrpc_result(req_id: Any, result: bytes) -> bytes:
+    """Wrap an already-serialized result in a JSON-RPC response."""
+    return b'{"jsonrpc":"2.0","id":' + json_dumps(req_id) + b',"result":' + result + b'}'
+
+
+@functools.lru_cache(maxsize=128)
+def encode_jsonrpc_error_object(code: int, message: str) -> bytes:
+    """Serialize a JSON-RPC error object (cached, the same errors repeat)."""
+    return json_dumps({"code": code, "message": message})
+
+
+def encode_jsonrpc_error(req_id: Any, code: int, message: str) -> bytes:
+    """Build a JSON-RPC error response."""
+    return (b'{"jsonrpc":"2.0","id":' + json_dumps(req_id) + b',"error":' +
+            encode_jsonrpc_error_object(code, message) + b'}')
+
+
+def encode_tool_result(text: str, is_error: bool) -> bytes:
+    """Serialize an MCP tool result holding a single text item."""
+    return (b'{"content":[{"type":"text","text":' + json_dumps(text) +
+            (b'}],"isError":true}' if is_error else b'}],"isError":false}'))
+
+
+# =============================================================================
+# Process Helpers
+# =============================================================================
+
+def reap_process(pid: int):
+    """Wait for a terminated child, killing it if it ignores SIGTERM."""
+    deadline = time.monotonic() + REAP_TIMEOUT
+    try:
+        while os.waitpid(pid, os.WNOHANG) == (0, 0):
+            if time.monotonic() > deadline:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+                return
+            time.sleep(0.1)
+    except ChildProcessError:
+        pass
+
+
 # =============================================================================
 # Relay Implementation
 # =============================================================================
 
+class StreamSlot:
+    """A pending relay-initiated stream: its ID, completion future and received data."""
+    __slots__ = ('id', 'future', 'data')
+
+    def __init__(self, stream_id: int, future: asyncio.Future, data):
+        self.id = stream_id
+        self.future = future
+        self.data = data
+
+
+class FileSink:
+    """Writes stream data to a host file from the default executor.
+
+    Data arriving while a write is in flight is batched into the next one;
+    the dispatcher only waits once SINK_BUFFER_LIMIT bytes are queued.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, file):
+        self.loop = loop
+        self.file = file
+        self.buffer = bytearray()
+        self.error: Optional[OSError] = None
+        self.closed = False
+        self.wakeup = asyncio.Event()
+        self.written = asyncio.Event()
+        self.task = loop.create_task(self.run())
+
+    def write(self, data):
+        """Queue data for the file; dropped once a write has failed."""
+        if self.error is None:
+            self.buffer += data
+            self.wakeup.set()
+
+    async def drain(self):
+        """Wait until the queued data is below SINK_BUFFER_LIMIT."""
+        while len(self.buffer) >= SINK_BUFFER_LIMIT and not self.task.done():
+            self.written.clear()
+            await self.written.wait()
+
+    async def close(self):
+        """Write out whatever is queued and stop; check error afterwards."""
+        self.closed = True
+        self.wakeup.set()
+        await self.task
+
+    async def run(self):
+        """Write queued data in order until closed or a write fails."""
+        try:
+            while self.buffer or not self.closed:
+                if not self.buffer:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                    continue
+                data, self.buffer = self.buffer, bytearray()
+                try:
+                    await self.loop.run_in_executor(None, self.file.write, data)
+                except OSError as e:
+                    self.error = e
+                    self.buffer = bytearray()
+                    return
+                self.written.set()
+        finally:
+            self.written.set()
+
+
+class StreamError(Exception):
+    """A STREAM_ERROR reported by the client."""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(f"Stream error {code}: {message}")
+        self.code = code
+
+
 class RelayV2:
     def __init__(self, host: str, port: int, mcp_port: int, claude_cmd: str):
         self.host = host
@@ -336,8 +560,12 @@ class RelayV2:
         self.mcp_port = mcp_port
         self.claude_cmd = claude_cmd
 
+        # Event loop (set in start())
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
         # Host file transfer base directory (restrict to cwd for security)
         self.host_base_dir = os.path.abspath(os.getcwd())
+        self.host_base_prefix = os.path.join(self.host_base_dir, '')
 
         # Client connection
         self.client_reader: Optional[asyncio.StreamReader] = None
@@ -346,23 +574,72 @@ class RelayV2:
 
         # Connection state
         self.remote_cwd: str = '/'
+        self.remote_cwd_prefix: str = '/'       # remote_cwd ending in '/', for resolve_path
         self.remote_window: int = DEFAULT_WINDOW
         self.bytes_in_flight: int = 0           # Bytes we've sent, awaiting client ack
         self.bytes_received_unacked: int = 0    # Bytes received from client, not yet acked
         self.resume_session: bool = False
         self.simple_mode: bool = False
-
-        # Stream management (relay uses even IDs)
-        self.next_stream_id: int = 0
-        self.pending_streams: Dict[int, asyncio.Future] = {}
-        self.stream_data: Dict[int, List[bytes]] = {}
+        self.client_can_edit: bool = False
+        self.client_can_write_excl: bool = False
+
+        # Stream management (relay uses even IDs). Pending streams live in a
+        # fixed slot table indexed by stream ID, bounded by the client's limit,
+        # and collect their data there. Data of finished streams moves to
+        # stream_data until the tool picks it up.
+        self.stream_ids = itertools.count(0, 2)
+        self.pending_streams: List[Optional[StreamSlot]] = [None] * MAX_STREAMS
+        self.stream_slots = asyncio.Semaphore(MAX_STREAMS)
+        self.stream_data: Dict[int, Any] = {}    # bytearray, or list of chunks for chunked streams
+
+        # Short-lived cache of list_directory/file_info results, keyed by
+        # (tool, path). The generation guards against storing a result that
+        # raced with a mutating tool call.
+        self.fs_cache: Dict[Tuple[str, str], Tuple[float, bytes]] = {}
+        self.fs_cache_generation = 0
+
+        # Claude launch config (prepared once in start())
+        self.mcp_config_path = '/tmp/telepresence-mcp-v2.json'
+        self.prompt_template: Optional[str] = None
 
         # PTY
         self.master_fd: Optional[int] = None
         self.claude_pid: Optional[int] = None
+        self.pty_ready: asyncio.Event = None
+        self.pty_inbuf = bytearray()            # PTY output not yet sent to client
+        self.pty_reading = False                # master_fd registered with add_reader
+        self.pty_eof = False
+        self.pty_outbuf = bytearray()           # Terminal input not yet accepted by PTY
 
         # MCP
         self.mcp_session_id: Optional[str] = None
+        self.mcp_session_header = b''           # Pre-encoded Mcp-Session-Id line
+        self.mcp_method_handlers = {
+            'initialize': self.handle_initialize,
+            'initialized': self.handle_empty_result,
+            'tools/list': self.handle_tools_list,
+            'tools/call': self.handle_tool_call,
+            'ping': self.handle_empty_result,
+        }
+        self.tool_handlers = {
+            'get_cwd': self.tool_get_cwd,
+            'read_file': self.tool_read_file,
+            'write_file': self.tool_write_file,
+            'edit_file': self.tool_edit_file,
+            'list_directory': self.tool_list_directory,
+            'file_info': self.tool_file_info,
+            'file_exists': self.tool_file_exists,
+            'search_files': self.tool_search_files,
+            'find_files': self.tool_find_files,
+            'execute_command': self.tool_execute_command,
+            'make_directory': self.tool_make_directory,
+            'remove_file': self.tool_remove_file,
+            'move_file': self.tool_move_file,
+            'download_url': self.tool_download_url,
+            'upload_to_host': self.tool_upload_to_host,
+            'download_from_host': self.tool_download_from_host,
+            'list_host_directory': self.tool_list_host_directory,
+        }
 
         # Synchronization
         self.send_lock = asyncio.Lock()
@@ -372,6 +649,15 @@ class RelayV2:
         # Packet dispatcher
         self.packet_queue: asyncio.Queue = None
         self.dispatcher_task: asyncio.Task = None
+        self.packet_handlers = {
+            PKT_STREAM_DATA: self.handle_stream_data,
+            PKT_STREAM_END: self.handle_stream_end,
+            PKT_STREAM_ERROR: self.handle_stream_error,
+            PKT_TERM_INPUT: self.handle_term_input,
+            PKT_TERM_RESIZE: self.handle_term_resize,
+            PKT_WINDOW_UPDATE: self.handle_window_update,
+            PKT_PING: self.handle_ping,
+        }
 
     # =========================================================================
     # Server Startup
@@ -379,6 +665,10 @@ class RelayV2:
 
     async def start(self):
         """Start TCP and MCP servers."""
+        self.loop = asyncio.get_running_loop()
+        self.write_mcp_config()
+        self.prompt_template = self.load_prompt_template()
+
         mcp_server = await asyncio.start_server(
             self.handle_mcp_connection,
             '127.0.0.1', self.mcp_port
@@ -412,11 +702,16 @@ class RelayV2:
         self.client_reader = reader
         self.client_writer = writer
 
-        # Disable Nagle's algorithm for low-latency
-        import socket
+        # Disable Nagle's algorithm for low-latency, and give the kernel room
+        # to buffer a full flow-control window in each direction
         sock = writer.get_extra_info('socket')
         if sock:
             sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+            except OSError:
+                pass
 
         try:
             # Wait for HELLO
@@ -433,7 +728,7 @@ class RelayV2:
 
             version = payload[0]
             flags = payload[1]
-            window = struct.unpack('>I', payload[2:6])[0]
+            window = UINT32.unpack_from(payload, 2)[0]
             cwd, _ = decode_string(payload, 6)
 
             if version != PROTOCOL_VERSION:
@@ -442,9 +737,12 @@ class RelayV2:
                 return
 
             self.remote_cwd = cwd
+            self.remote_cwd_prefix = cwd.rstrip('/') + '/' if cwd else ''
             self.remote_window = window
             self.resume_session = bool(flags & FLAG_RESUME)
             self.simple_mode = bool(flags & FLAG_SIMPLE)
+            self.client_can_edit = bool(flags & FLAG_CAP_EDIT)
+            self.client_can_write_excl = bool(flags & FLAG_CAP_WRITE_EXCL)
 
             mode_str = []
             if self.resume_session:
@@ -498,9 +796,8 @@ class RelayV2:
 
     async def recv_packet(self) -> Tuple[int, bytes]:
         """Receive a v2 packet."""
-        header = await self.client_reader.readexactly(5)
-        pkt_type = header[0]
-        length = struct.unpack('>I', header[1:5])[0]
+        header = await self.client_reader.readexactly(PACKET_HEADER.size)
+        pkt_type, length = PACKET_HEADER.unpack(header)
 
         if length > MAX_PAYLOAD:
             raise ValueError(f"Payload too large: {length}")
@@ -517,10 +814,48 @@ class RelayV2:
                     await self.window_available.wait()
                 self.bytes_in_flight += len(payload)
 
-            packet = encode_packet(pkt_type, payload)
-            self.client_writer.write(packet)
+            # Header and payload go out as separate buffers, so large
+            # payloads are never copied into a concatenated packet;
+            # small control packets are cheaper as a single write
+            header = encode_header(pkt_type, len(payload))
+            if len(payload) < SMALL_PACKET:
+                self.client_writer.write(header + payload)
+            else:
+                self.client_writer.writelines((header, payload))
             await self.client_writer.drain()
 
+    def send_control_packet(self, pkt_type: int, payload: bytes):
+        """Queue a small control packet without taking send_lock or draining."""
+        # Every write puts whole packets into the transport synchronously,
+        # so a control packet can never land inside another packet
+        self.client_writer.write(encode_header(pkt_type, len(payload)) + payload)
+
+    async def send_stream_data(self, stream_id: int, data: bytes):
+        """Send data as CHUNK_SIZE STREAM_DATA packets, batching what the window allows."""
+        sid = UINT32.pack(stream_id)
+        view = memoryview(data)
+        offset = 0
+        while offset < len(data):
+            async with self.send_lock:
+                # Wait for room for one packet, then queue every packet that
+                # fits in the window and drain once for the whole batch
+                buffers = []
+                while offset < len(data):
+                    chunk = view[offset:offset + CHUNK_SIZE]
+                    size = 4 + len(chunk)
+                    if self.bytes_in_flight + size > self.remote_window:
+                        if buffers:
+                            break
+                        self.window_available.clear()
+                        await self.window_available.wait()
+                        continue
+                    buffers += (encode_header(PKT_STREAM_DATA, size), sid, chunk)
+                    self.bytes_in_flight += size
+                    offset += len(chunk)
+
+                self.client_writer.writelines(buffers)
+                await self.client_writer.drain()
+
     async def send_goodbye(self, reason: int):
         """Send GOODBYE packet."""
         await self.send_packet(PKT_GOODBYE, bytes([reason]))
@@ -531,7 +866,7 @@ class RelayV2:
         if self.bytes_received_unacked >= WINDOW_UPDATE_THRESHOLD:
             increment = self.bytes_received_unacked
             self.bytes_received_unacked = 0
-            await self.send_packet(PKT_WINDOW_UPDATE, struct.pack('>I', increment))
+            self.send_control_packet(PKT_WINDOW_UPDATE, UINT32.pack(increment))
 
     # =========================================================================
     # PTY Management
@@ -544,22 +879,9 @@ class RelayV2:
         env = os.environ.copy()
         env['TERM'] = 'xterm-256color'
 
-        # Write MCP config
-        mcp_config = {
-            "mcpServers": {
-                "telepresence": {
-                    "type": "http",
-                    "url": f"http://127.0.0.1:{self.mcp_port}/mcp"
-                }
-            }
-        }
-        mcp_config_path = '/tmp/telepresence-mcp-v2.json'
-        with open(mcp_config_path, 'w') as f:
-            json.dump(mcp_config, f)
-
         system_prompt = self.build_system_prompt()
 
-        cmd = ['claude', '--mcp-config', mcp_config_path, '--strict-mcp-config',
+        cmd = ['claude', '--mcp-config', self.mcp_config_path, '--strict-mcp-config',
                '--append-system-prompt', system_prompt]
         if self.resume_session:
             cmd.insert(1, '--resume')
@@ -567,24 +889,20 @@ class RelayV2:
         pid = os.fork()
         if pid == 0:
             # Child
-            os.close(master_fd)
-            os.setsid()
-            fcntl.ioctl(slave_fd, termios.TIOCSCTTY, 0)
-            os.dup2(slave_fd, 0)
-            os.dup2(slave_fd, 1)
-            os.dup2(slave_fd, 2)
-            if slave_fd > 2:
-                os.close(slave_fd)
-            # Close inherited fds
-            import resource
-            maxfd = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
-            for fd in range(3, min(maxfd, 256)):
-                try:
-                    os.close(fd)
-                except OSError:
-                    pass
-            os.execvpe(cmd[0], cmd, env)
-            sys.exit(1)
+            try:
+                os.close(master_fd)
+                os.setsid()
+                fcntl.ioctl(slave_fd, termios.TIOCSCTTY, 0)
+                os.dup2(slave_fd, 0)
+                os.dup2(slave_fd, 1)
+                os.dup2(slave_fd, 2)
+                if slave_fd > 2:
+                    os.close(slave_fd)
+                # Close inherited fds in one call (close_range() where available)
+                os.closerange(3, resource.getrlimit(resource.RLIMIT_NOFILE)[0])
+                os.execvpe(cmd[0], cmd, env)
+            finally:
+                os._exit(1)
 
         # Parent
         os.close(slave_fd)
@@ -596,8 +914,21 @@ class RelayV2:
 
         print(f"  Claude PID: {pid}")
 
-    def build_system_prompt(self) -> str:
-        """Build telepresence system prompt from template file."""
+    def write_mcp_config(self):
+        """Write the MCP config file passed to every Claude session."""
+        mcp_config = {
+            "mcpServers": {
+                "telepresence": {
+                    "type": "http",
+                    "url": f"http://127.0.0.1:{self.mcp_port}/mcp"
+                }
+            }
+        }
+        with open(self.mcp_config_path, 'w') as f:
+            json.dump(mcp_config, f)
+
+    def load_prompt_template(self) -> Optional[str]:
+        """Load telepresence system prompt template file, if any."""
         script_dir = os.path.dirname(os.path.abspath(__file__))
         prompt_file = os.path.join(script_dir, 'telepresence_prompt.txt')
 
@@ -609,11 +940,20 @@ class RelayV2:
         if os.path.exists(prompt_file):
             try:
                 with open(prompt_file, 'r') as f:
-                    template = f.read()
-                return template.format(remote_cwd=self.remote_cwd)
+                    return f.read()
             except Exception as e:
                 print(f"Warning: Could not load prompt file: {e}")
 
+        return None
+
+    def build_system_prompt(self) -> str:
+        """Build telepresence system prompt from template."""
+        if self.prompt_template is not None:
+            try:
+                return self.prompt_template.format(remote_cwd=self.remote_cwd)
+            except Exception as e:
+                print(f"Warning: Could not format prompt file: {e}")
+
         return f"""TELEPRESENCE MODE - Connected to REMOTE legacy Unix system.
 Remote working directory: {self.remote_cwd}
 
@@ -622,58 +962,68 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
 
     async def pty_to_client(self):
         """Forward PTY output to client."""
-        loop = asyncio.get_running_loop()
+        self.pty_ready = asyncio.Event()
+        self.pty_inbuf.clear()
+        self.pty_eof = False
+        self.loop.add_reader(self.master_fd, self.on_pty_readable)
+        self.pty_reading = True
 
-        while True:
-            try:
-                data = await loop.run_in_executor(None, self.read_pty)
-                if data is None:
-                    break
-                if data:
+        try:
+            while True:
+                await self.pty_ready.wait()
+                self.pty_ready.clear()
+
+                # Output that arrived while the last packet was being sent
+                # has piled up in pty_inbuf; send it as few packets as possible
+                while self.pty_inbuf:
+                    data = bytes(self.pty_inbuf[:CHUNK_SIZE])
+                    del self.pty_inbuf[:CHUNK_SIZE]
+                    if not self.pty_reading and not self.pty_eof and len(self.pty_inbuf) < PTY_BUFFER_LIMIT:
+                        self.loop.add_reader(self.master_fd, self.on_pty_readable)
+                        self.pty_reading = True
                     await self.send_packet(PKT_TERM_OUTPUT, data)
-            except Exception:
-                break
 
-    def read_pty(self) -> Optional[bytes]:
-        """Read from PTY (blocking, run in executor)."""
-        import select
+                if self.pty_eof:
+                    break
+        except Exception:
+            pass
+        finally:
+            if self.master_fd and self.pty_reading:
+                self.loop.remove_reader(self.master_fd)
+                self.pty_reading = False
+
+    def on_pty_readable(self):
+        """Read available PTY output (event loop reader callback)."""
         try:
-            r, _, _ = select.select([self.master_fd], [], [], 0.01)
-            if r:
-                return os.read(self.master_fd, 65536)
-            return b''
+            data = os.read(self.master_fd, 65536)
+        except BlockingIOError:
+            return
         except OSError:
-            return None
+            data = b''
+
+        if data:
+            self.pty_inbuf += data
+        else:
+            # EOF (EIO on Linux once the slave side is gone)
+            self.pty_eof = True
+
+        # Stop reading while the client can't keep up; the PTY then blocks
+        # Claude instead of output piling up here
+        if self.pty_eof or len(self.pty_inbuf) >= PTY_BUFFER_LIMIT:
+            self.loop.remove_reader(self.master_fd)
+            self.pty_reading = False
+        self.pty_ready.set()
 
     async def packet_dispatcher(self):
         """Read packets from client and dispatch to handlers."""
+        handlers = self.packet_handlers
         while True:
             try:
                 pkt_type, payload = await self.recv_packet()
 
-                if pkt_type in (PKT_STREAM_DATA, PKT_STREAM_END, PKT_STREAM_ERROR):
-                    if pkt_type == PKT_STREAM_DATA:
-                        await self.handle_stream_data(payload)
-                        await self.ack_received_bytes(len(payload))
-                    elif pkt_type == PKT_STREAM_END:
-                        await self.handle_stream_end(payload)
-                    elif pkt_type == PKT_STREAM_ERROR:
-                        await self.handle_stream_error(payload)
-
-                elif pkt_type in (PKT_TERM_INPUT, PKT_TERM_RESIZE):
-                    await self.packet_queue.put((pkt_type, payload))
-                    if pkt_type == PKT_TERM_INPUT:
-                        await self.ack_received_bytes(len(payload))
-
-                elif pkt_type == PKT_WINDOW_UPDATE:
-                    if len(payload) >= 4:
-                        increment = struct.unpack('>I', payload[:4])[0]
-                        self.bytes_in_flight = max(0, self.bytes_in_flight - increment)
-                        self.window_available.set()
-
-                elif pkt_type == PKT_PING:
-                    await self.send_packet(PKT_PONG, payload)
-
+                handler = handlers.get(pkt_type)
+                if handler is not None:
+                    await handler(payload)
                 elif pkt_type == PKT_GOODBYE:
                     break
 
@@ -682,6 +1032,26 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
             except Exception:
                 break
 
+    async def handle_term_input(self, payload: bytes):
+        """Handle TERM_INPUT from client."""
+        await self.packet_queue.put((PKT_TERM_INPUT, payload))
+        await self.ack_received_bytes(len(payload))
+
+    async def handle_term_resize(self, payload: bytes):
+        """Handle TERM_RESIZE from client."""
+        await self.packet_queue.put((PKT_TERM_RESIZE, payload))
+
+    async def handle_window_update(self, payload: bytes):
+        """Handle WINDOW_UPDATE from client."""
+        if len(payload) >= 4:
+            increment = UINT32.unpack_from(payload)[0]
+            self.bytes_in_flight = max(0, self.bytes_in_flight - increment)
+            self.window_available.set()
+
+    async def handle_ping(self, payload: bytes):
+        """Handle PING from client."""
+        self.send_control_packet(PKT_PONG, payload)
+
     async def terminal_handler(self):
         """Process terminal packets from queue."""
         while True:
@@ -690,11 +1060,11 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
 
                 if pkt_type == PKT_TERM_INPUT:
                     if self.master_fd:
-                        os.write(self.master_fd, payload)
+                        self.write_pty(payload)
 
                 elif pkt_type == PKT_TERM_RESIZE:
                     if len(payload) >= 4:
-                        rows, cols = struct.unpack('>HH', payload[:4])
+                        rows, cols = RESIZE.unpack_from(payload)
                         self.resize_pty(rows, cols)
 
             except asyncio.CancelledError:
@@ -702,6 +1072,33 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
             except Exception:
                 break
 
+    def write_pty(self, data: bytes):
+        """Write terminal input to PTY, buffering what it can't take yet."""
+        if not self.pty_outbuf:
+            try:
+                n = os.write(self.master_fd, data)
+            except BlockingIOError:
+                n = 0
+            if n == len(data):
+                return
+            data = data[n:]
+            self.loop.add_writer(self.master_fd, self.on_pty_writable)
+        self.pty_outbuf.extend(data)
+
+    def on_pty_writable(self):
+        """Flush buffered terminal input (event loop writer callback)."""
+        try:
+            with memoryview(self.pty_outbuf) as view:
+                n = os.write(self.master_fd, view)
+        except BlockingIOError:
+            return
+        except OSError:
+            n = len(self.pty_outbuf)
+
+        del self.pty_outbuf[:n]
+        if not self.pty_outbuf:
+            self.loop.remove_writer(self.master_fd)
+
     def resize_pty(self, rows: int, cols: int):
         """Resize PTY."""
         if self.master_fd:
@@ -713,125 +1110,224 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
     # =========================================================================
 
     def alloc_stream_id(self) -> int:
-        """Allocate even stream ID."""
-        sid = self.next_stream_id
-        self.next_stream_id += 2
-        return sid
-
-    async def open_stream(self, stream_type: int, metadata: bytes) -> int:
-        """Open a stream to client."""
+        """Allocate even stream ID whose pending slot is free."""
+        for sid in self.stream_ids:
+            if self.pending_streams[(sid >> 1) % MAX_STREAMS] is None:
+                return sid
+
+    def stream_future(self, stream_id: int) -> Optional[asyncio.Future]:
+        """Look up the completion future of a pending stream."""
+        entry = self.pending_streams[(stream_id >> 1) % MAX_STREAMS]
+        if entry is not None and entry.id == stream_id:
+            return entry.future
+        return None
+
+    def release_stream(self, stream_id: int, keep_data: bool = False):
+        """Free a pending stream slot.
+
+        With keep_data, received data is handed to get_stream_data();
+        otherwise it is dropped with the slot.
+        """
+        slot = (stream_id >> 1) % MAX_STREAMS
+        entry = self.pending_streams[slot]
+        if entry is not None and entry.id == stream_id:
+            self.pending_streams[slot] = None
+            self.stream_slots.release()
+            if keep_data and entry.data and isinstance(entry.data, (bytearray, list)):
+                self.stream_data[stream_id] = entry.data
+
+    async def open_stream(self, stream_type: int, metadata: bytes, chunked: bool = False,
+                          sink=None) -> int:
+        """Open a stream to client.
+
+        Chunked streams keep packet boundaries; a FileSink receives the
+        data as it arrives instead of buffering it.
+        """
+        await self.stream_slots.acquire()
         stream_id = self.alloc_stream_id()
 
-        self.pending_streams[stream_id] = asyncio.get_event_loop().create_future()
-        self.stream_data[stream_id] = []
+        future = self.loop.create_future()
+        data = sink if sink is not None else [] if chunked else bytearray()
+        self.pending_streams[(stream_id >> 1) % MAX_STREAMS] = StreamSlot(stream_id, future, data)
 
         payload = struct.pack('>IB', stream_id, stream_type) + metadata
-        await self.send_packet(PKT_STREAM_OPEN, payload)
+        try:
+            await self.send_packet(PKT_STREAM_OPEN, payload)
+        except BaseException:
+            self.release_stream(stream_id)
+            raise
 
         return stream_id
 
     async def wait_stream(self, stream_id: int, timeout: float = 300.0) -> Tuple[int, bytes]:
         """Wait for stream completion. Returns (status, extra_data)."""
+        future = self.stream_future(stream_id)
+        if future is None:
+            raise Exception("Stream closed")
+        succeeded = False
         try:
-            result = await asyncio.wait_for(
-                self.pending_streams[stream_id],
-                timeout=timeout
-            )
+            result = await asyncio.wait_for(future, timeout=timeout)
+            succeeded = result[0] == STATUS_OK
             return result
         except asyncio.TimeoutError:
+            # Tell the client to stop before the slot (and ID) is reused
+            try:
+                self.send_control_packet(PKT_STREAM_CANCEL, UINT32.pack(stream_id))
+            except Exception:
+                pass
             raise Exception("Stream timeout")
         finally:
-            self.pending_streams.pop(stream_id, None)
+            # Only a successful stream's data is collected by the caller
+            self.release_stream(stream_id, succeeded)
 
-    def get_stream_data(self, stream_id: int) -> bytes:
-        """Get accumulated stream data as single bytes."""
-        chunks = self.stream_data.pop(stream_id, [])
-        return b''.join(chunks)
+    def get_stream_data(self, stream_id: int) -> bytearray:
+        """Get accumulated stream data (the receive buffer itself, not a copy)."""
+        return self.stream_data.pop(stream_id, None) or bytearray()
 
     def get_stream_chunks(self, stream_id: int) -> List[bytes]:
-        """Get stream data as separate chunks (preserves boundaries)."""
-        return self.stream_data.pop(stream_id, [])
+        """Get data of a chunked stream as separate chunks (preserves boundaries)."""
+        return self.stream_data.pop(stream_id, None) or []
+
+    async def remove_remote_file(self, path: str):
+        """Remove a file the relay created on the remote, ignoring errors."""
+        try:
+            await self.wait_stream(await self.open_stream(STREAM_REMOVE, encode_string(path)))
+        except Exception:
+            pass
+
+    async def abort_remote_write(self, stream_id: int, path: str):
+        """Cancel a FILE_WRITE stream and remove the partial file it left.
+
+        Only used on files the transfer itself created. Best-effort: errors
+        are swallowed so the caller's failure is reported.
+        """
+        try:
+            await self.send_packet(PKT_STREAM_CANCEL, UINT32.pack(stream_id))
+        except Exception:
+            pass
+        try:
+            await self.wait_stream(stream_id)
+        except Exception:
+            pass
+        await self.remove_remote_file(path)
+
+    async def install_remote_file(self, stream_id: int, temp_path: str, path: str) -> int:
+        """Wait for a FILE_WRITE to temp_path, then move it over path.
+
+        A write that does not complete removes temp_path instead, so an
+        existing file at path is only ever replaced whole. Returns the status.
+        """
+        try:
+            status, _ = await self.wait_stream(stream_id)
+            if status == STATUS_OK:
+                metadata = encode_string(temp_path) + encode_string(path)
+                status, _ = await self.wait_stream(await self.open_stream(STREAM_MOVE, metadata))
+        except Exception:
+            await self.remove_remote_file(temp_path)
+            raise
+        if status != STATUS_OK:
+            await self.remove_remote_file(temp_path)
+        return status
 
     async def handle_stream_data(self, payload: bytes):
         """Handle STREAM_DATA from client."""
+        await self.ack_received_bytes(len(payload))
         if len(payload) < 4:
             return
-        stream_id = struct.unpack('>I', payload[:4])[0]
-        data = payload[4:]
+        stream_id = UINT32.unpack_from(payload)[0]
 
-        if stream_id in self.stream_data:
-            self.stream_data[stream_id].append(data)
+        entry = self.pending_streams[(stream_id >> 1) % MAX_STREAMS]
+        if entry is None or entry.id != stream_id:
+            return
+        data = entry.data
+        if data.__class__ is bytearray:
+            data += memoryview(payload)[4:]
+        elif data.__class__ is list:
+            data.append(payload[4:])
+        else:
+            data.write(memoryview(payload)[4:])
+            if data.error is not None:
+                if not entry.future.done():
+                    entry.future.set_exception(Exception(f"Failed to write host file: {data.error}"))
+            elif len(data.buffer) >= SINK_BUFFER_LIMIT:
+                await data.drain()
 
     async def handle_stream_end(self, payload: bytes):
         """Handle STREAM_END from client."""
         if len(payload) < 5:
             return
-        stream_id = struct.unpack('>I', payload[:4])[0]
+        stream_id = UINT32.unpack_from(payload)[0]
         status = payload[4]
         extra = payload[5:]
 
-        if stream_id in self.pending_streams:
-            self.pending_streams[stream_id].set_result((status, extra))
+        future = self.stream_future(stream_id)
+        if future is not None and not future.done():
+            future.set_result((status, extra))
 
     async def handle_stream_error(self, payload: bytes):
         """Handle STREAM_ERROR from client."""
         if len(payload) < 5:
             return
-        stream_id = struct.unpack('>I', payload[:4])[0]
+        stream_id = UINT32.unpack_from(payload)[0]
         error_code = payload[4]
         message, _ = decode_string(payload, 5) if len(payload) > 5 else ("Unknown error", 0)
 
-        if stream_id in self.pending_streams:
-            self.pending_streams[stream_id].set_exception(
-                Exception(f"Stream error {error_code}: {message}")
-            )
+        future = self.stream_future(stream_id)
+        if future is not None and not future.done():
+            future.set_exception(StreamError(error_code, message))
 
     # =========================================================================
     # MCP HTTP Server
     # =========================================================================
 
     async def handle_mcp_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
-        """Handle MCP HTTP connection."""
-        try:
-            request_line = await reader.readline()
-            if not request_line:
-                return
-
-            parts = request_line.decode('utf-8', errors='replace').strip().split(' ')
-            if len(parts) < 2:
-                await self.send_http_error(writer, 400, "Bad Request")
-                return
-
-            method, path = parts[0], parts[1]
+        """Handle MCP HTTP connection (HTTP/1.1 keep-alive)."""
+        # Small JSON responses on loopback; don't let Nagle hold them back
+        sock = writer.get_extra_info('socket')
+        if sock:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        writer.transport.set_write_buffer_limits(high=MCP_WRITE_HIGH_WATER)
 
-            headers = {}
+        try:
             while True:
-                line = await reader.readline()
-                if line in (b'\r\n', b'\n', b''):
+                # Read the whole request head at once rather than line by line
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), MCP_IDLE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError):
                     break
-                line = line.decode('utf-8', errors='replace').strip()
-                if ':' in line:
-                    k, v = line.split(':', 1)
-                    headers[k.lower().strip()] = v.strip()
 
-            if path != '/mcp':
-                await self.send_http_error(writer, 404, "Not Found")
-                return
+                request_head = parse_http_head(head)
+                if request_head is None:
+                    await self.send_http_error(writer, 400, "Bad Request")
+                    break
 
-            if method == 'POST':
+                method, path, version, headers = request_head
                 content_length = int(headers.get('content-length', 0))
                 body = await reader.readexactly(content_length) if content_length > 0 else b''
 
-                try:
-                    request = json.loads(body.decode('utf-8'))
-                except json.JSONDecodeError as e:
-                    await self.send_jsonrpc_error(writer, None, -32700, str(e))
-                    return
+                if path != '/mcp':
+                    await self.send_http_error(writer, 404, "Not Found")
+                    break
+                if method != 'POST':
+                    await self.send_http_error(writer, 405, "Method Not Allowed")
+                    break
 
-                response = await self.handle_mcp_request(request)
-                await self.send_http_json(writer, response)
-            else:
-                await self.send_http_error(writer, 405, "Method Not Allowed")
+                connection = headers.get('connection', '').lower()
+                if version == 'HTTP/1.0':
+                    keep_alive = connection == 'keep-alive'
+                else:
+                    keep_alive = connection != 'close'
+
+                try:
+                    request = json_loads(body)
+                except ValueError as e:
+                    await self.send_jsonrpc_error(writer, None, -32700, str(e), keep_alive)
+                else:
+                    response = await self.handle_mcp_request(request)
+                    await self.send_http_json(writer, response, keep_alive)
+
+                if not keep_alive:
+                    break
 
         except Exception:
             pass
@@ -841,134 +1337,132 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
 
     async def send_http_error(self, writer, status: int, message: str):
         """Send HTTP error."""
-        body = json.dumps({"error": message}).encode('utf-8')
-        response = f"HTTP/1.1 {status} {message}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
-        writer.write(response)
-        await writer.drain()
-
-    async def send_http_json(self, writer, data: dict):
-        """Send HTTP JSON response."""
-        body = json.dumps(data).encode('utf-8')
-        headers = f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: close\r\n"
-        if self.mcp_session_id:
-            headers += f"Mcp-Session-Id: {self.mcp_session_id}\r\n"
-        headers += "\r\n"
-        writer.write(headers.encode() + body)
-        await writer.drain()
-
-    async def send_jsonrpc_error(self, writer, req_id, code: int, message: str):
+        body = json_dumps({"error": message})
+        head = (b"HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nConnection: close\r\n"
+                b"Content-Length: %d\r\n\r\n" % (status, message.encode('latin-1'), len(body)))
+        writer.writelines((head, body))
+        await self.maybe_drain(writer)
+
+    async def send_http_json(self, writer, body: bytes, keep_alive: bool = False):
+        """Send HTTP JSON response (body is already serialized)."""
+        head = HTTP_JSON_HEAD_KEEP_ALIVE if keep_alive else HTTP_JSON_HEAD_CLOSE
+        head += b"Content-Length: %d\r\n%s\r\n" % (len(body), self.mcp_session_header)
+        writer.writelines((head, body))
+        await self.maybe_drain(writer)
+
+    async def maybe_drain(self, writer):
+        """Wait for the transport only when its buffer is over the high-water mark."""
+        if writer.transport.get_write_buffer_size() > MCP_WRITE_HIGH_WATER:
+            await writer.drain()
+
+    async def send_jsonrpc_error(self, writer, req_id, code: int, message: str, keep_alive: bool = False):
         """Send JSON-RPC error."""
-        response = {"jsonrpc": "2.0", "id": req_id, "error": {"code": code, "message": message}}
-        await self.send_http_json(writer, response)
+        await self.send_http_json(writer, encode_jsonrpc_error(req_id, code, message), keep_alive)
 
-    async def handle_mcp_request(self, request: dict) -> dict:
+    async def handle_mcp_request(self, request: dict) -> bytes:
         """Handle MCP JSON-RPC request."""
         req_id = request.get('id')
         method = request.get('method', '')
-        params = request.get('params', {})
-
-        if method == 'initialize':
-            self.mcp_session_id = secrets.token_hex(16)
-            return {
-                "jsonrpc": "2.0",
-                "id": req_id,
-                "result": {
-                    "protocolVersion": MCP_PROTOCOL_VERSION,
-                    "capabilities": {"tools": {}},
-                    "serverInfo": {"name": MCP_SERVER_NAME, "version": MCP_SERVER_VERSION}
-                }
-            }
-
-        elif method == 'initialized':
-            return {"jsonrpc": "2.0", "id": req_id, "result": {}}
+        params = request.get('params') or MCP_EMPTY_PARAMS
 
-        elif method == 'tools/list':
-            return {"jsonrpc": "2.0", "id": req_id, "result": {"tools": MCP_TOOLS}}
+        handler = self.mcp_method_handlers.get(method)
+        if not handler:
+            return encode_jsonrpc_error(req_id, -32601, f"Unknown method: {method}")
+        return await handler(req_id, params)
 
-        elif method == 'tools/call':
-            return await self.handle_tool_call(req_id, params)
+    async def handle_initialize(self, req_id, params: dict) -> bytes:
+        """Start a new MCP session."""
+        self.mcp_session_id = secrets.token_hex(16)
+        self.mcp_session_header = b"Mcp-Session-Id: %s\r\n" % self.mcp_session_id.encode('ascii')
+        return encode_jsonrpc_result(req_id, MCP_INITIALIZE_RESULT)
 
-        elif method == 'ping':
-            return {"jsonrpc": "2.0", "id": req_id, "result": {}}
+    async def handle_tools_list(self, req_id, params: dict) -> bytes:
+        """Return the static tool list."""
+        return encode_jsonrpc_result(req_id, MCP_TOOLS_RESULT)
 
-        else:
-            return {"jsonrpc": "2.0", "id": req_id, "error": {"code": -32601, "message": f"Unknown method: {method}"}}
+    async def handle_empty_result(self, req_id, params: dict) -> bytes:
+        """Acknowledge a method that has no result (initialized, ping)."""
+        return encode_jsonrpc_result(req_id, MCP_EMPTY_RESULT)
 
     # =========================================================================
     # MCP Tool Handlers
     # =========================================================================
 
-    async def handle_tool_call(self, req_id, params: dict) -> dict:
+    async def handle_tool_call(self, req_id, params: dict) -> bytes:
         """Handle MCP tool call."""
         tool_name = params.get('name', '')
-        args = params.get('arguments', {})
+        args = params.get('arguments') or MCP_EMPTY_PARAMS
 
         if not self.client_connected.is_set():
             return self.tool_error(req_id, "Client not connected")
 
         try:
-            handlers = {
-                'get_cwd': self.tool_get_cwd,
-                'read_file': self.tool_read_file,
-                'write_file': self.tool_write_file,
-                'edit_file': self.tool_edit_file,
-                'list_directory': self.tool_list_directory,
-                'file_info': self.tool_file_info,
-                'file_exists': self.tool_file_exists,
-                'search_files': self.tool_search_files,
-                'find_files': self.tool_find_files,
-                'execute_command': self.tool_execute_command,
-                'make_directory': self.tool_make_directory,
-                'remove_file': self.tool_remove_file,
-                'move_file': self.tool_move_file,
-                'download_url': self.tool_download_url,
-                'upload_to_host': self.tool_upload_to_host,
-                'download_from_host': self.tool_download_from_host,
-                'list_host_directory': self.tool_list_host_directory,
-            }
-
-            handler = handlers.get(tool_name)
+            handler = self.tool_handlers.get(tool_name)
             if not handler:
                 return self.tool_error(req_id, f"Unknown tool: {tool_name}")
 
-            result = await handler(args)
-            return {"jsonrpc": "2.0", "id": req_id, "result": result}
+            if tool_name in READ_ONLY_TOOLS:
+                result = await handler(args)
+            else:
+                self.invalidate_fs_cache()
+                try:
+                    result = await handler(args)
+                finally:
+                    self.invalidate_fs_cache()
+            return encode_jsonrpc_result(req_id, result)
 
         except Exception as e:
             return self.tool_error(req_id, str(e))
 
-    def tool_error(self, req_id, message: str) -> dict:
+    def fs_cache_get(self, key: Tuple[str, str]) -> Optional[bytes]:
+        """Return a cached tool result if it is still fresh."""
+        entry = self.fs_cache.get(key)
+        if entry is not None and time.monotonic() - entry[0] < FS_CACHE_TTL:
+            return entry[1]
+        return None
+
+    def fs_cache_put(self, key: Tuple[str, str], generation: int, result: bytes) -> bytes:
+        """Cache a tool result unless the filesystem changed meanwhile."""
+        if generation == self.fs_cache_generation:
+            if len(self.fs_cache) >= FS_CACHE_MAX:
+                self.fs_cache.clear()
+            self.fs_cache[key] = (time.monotonic(), result)
+        return result
+
+    def invalidate_fs_cache(self):
+        """Drop all cached filesystem results."""
+        self.fs_cache.clear()
+        self.fs_cache_generation += 1
+
+    def tool_error(self, req_id, message: str) -> bytes:
         """Return tool error response."""
-        return {
-            "jsonrpc": "2.0",
-            "id": req_id,
-            "result": {"content": [{"type": "text", "text": f"Error: {message}"}], "isError": True}
-        }
+        return encode_jsonrpc_result(req_id, encode_tool_result(f"Error: {message}", True))
 
-    def tool_success(self, text: str) -> dict:
-        """Return tool success response."""
-        return {"content": [{"type": "text", "text": text}], "isError": False}
+    def tool_success(self, text: str) -> bytes:
+        """Return tool success result."""
+        return encode_tool_result(text, False)
 
     def resolve_path(self, path: str) -> str:
         """Resolve path against remote cwd."""
-        if not path or path.startswith('/'):
+        if not path or path[0] == '/':
             return path or self.remote_cwd
-        import posixpath
-        return posixpath.normpath(posixpath.join(self.remote_cwd, path))
+        return posixpath.normpath(self.remote_cwd_prefix + path)
 
     def resolve_host_path(self, path: str) -> str:
         """Resolve and validate host path, restricting to base directory.
 
         Raises Exception if path escapes base directory.
         """
-        # Expand ~ and make absolute
-        expanded = os.path.expanduser(path)
-        if not os.path.isabs(expanded):
-            expanded = os.path.join(self.host_base_dir, expanded)
-        resolved = os.path.abspath(expanded)
+        # Expand ~ and make absolute; the path is joined to the base here,
+        # so normpath gives the same result as abspath without a getcwd()
+        if path[:1] == '~':
+            path = os.path.expanduser(path)
+        if not os.path.isabs(path):
+            path = self.host_base_prefix + path
+        resolved = os.path.normpath(path)
 
         # Security check: must be under base directory
-        if not resolved.startswith(self.host_base_dir + os.sep) and resolved != self.host_base_dir:
+        if not resolved.startswith(self.host_base_prefix) and resolved != self.host_base_dir:
             raise Exception(f"Host path must be under {self.host_base_dir}")
 
         return resolved
@@ -977,7 +1471,7 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
     # Tool: get_cwd
     # -------------------------------------------------------------------------
 
-    async def tool_get_cwd(self, args: dict) -> dict:
+    async def tool_get_cwd(self, args: dict) -> bytes:
         """Return remote working directory."""
         return self.tool_success(f"Current working directory: {self.remote_cwd}")
 
@@ -985,7 +1479,7 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
     # Tool: read_file
     # -------------------------------------------------------------------------
 
-    async def tool_read_file(self, args: dict) -> dict:
+    async def tool_read_file(self, args: dict) -> bytes:
         """Read file via FILE_READ stream."""
         path = self.resolve_path(args.get('path', ''))
         offset = args.get('offset', 0)
@@ -993,6 +1487,8 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
 
         if not path:
             raise Exception("path is required")
+        if offset < 0:
+            raise Exception("offset must be 0 or greater")
 
         stream_id = await self.open_stream(STREAM_FILE_READ, encode_string(path))
         status, extra = await self.wait_stream(stream_id)
@@ -1001,17 +1497,33 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
             raise Exception(f"Read failed: status={status}")
 
         content = self.get_stream_data(stream_id)
+        total = content.count(b'\n') + 1
+
+        # Locate the byte window for the requested lines; only it is decoded
+        start = 0
+        for _ in range(min(offset, total)):
+            start = content.find(b'\n', start) + 1
+        end = start - 1
+        for _ in range(min(limit, total - offset)):
+            end = content.find(b'\n', end + 1)
+            if end < 0:
+                end = len(content)
+                break
 
-        try:
-            text = content.decode('utf-8', errors='replace')
-        except:
-            text = content.decode('latin-1')
-
-        lines = text.split('\n')
-        total = len(lines)
-        selected = lines[offset:offset + limit]
+        if offset < total and limit > 0:
+            window = content[start:end]
+            try:
+                text = window.decode('utf-8', errors='replace')
+            except:
+                text = window.decode('latin-1')
+            selected = text.split('\n')
+        else:
+            selected = []
 
-        formatted = '\n'.join(f"{i+offset+1:6}\t{line[:2000]}" for i, line in enumerate(selected))
+        if selected and max(map(len, selected)) > MAX_LINE_LENGTH:
+            selected = [line[:MAX_LINE_LENGTH] for line in selected]
+        numbered = zip(range(offset + 1, offset + 1 + len(selected)), selected)
+        formatted = '\n'.join(['%6d\t%s' % item for item in numbered])
 
         if offset + limit < total:
             formatted += f"\n\n[Lines {offset+1}-{offset+len(selected)} of {total}]"
@@ -1022,7 +1534,7 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
     # Tool: write_file
     # -------------------------------------------------------------------------
 
-    async def tool_write_file(self, args: dict) -> dict:
+    async def tool_write_file(self, args: dict) -> bytes:
         """Write file via FILE_WRITE stream."""
         path = self.resolve_path(args.get('path', ''))
         content = args.get('content', '')
@@ -1034,10 +1546,7 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
         stream_id = await self.open_stream(STREAM_FILE_WRITE, metadata)
 
         data = content.encode('utf-8')
-        for i in range(0, len(data), CHUNK_SIZE):
-            chunk = data[i:i + CHUNK_SIZE]
-            payload = struct.pack('>I', stream_id) + chunk
-            await self.send_packet(PKT_STREAM_DATA, payload)
+        await self.send_stream_data(stream_id, data)
 
         payload = struct.pack('>IB', stream_id, STATUS_OK)
         await self.send_packet(PKT_STREAM_END, payload)
@@ -1053,8 +1562,8 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
     # Tool: edit_file
     # -------------------------------------------------------------------------
 
-    async def tool_edit_file(self, args: dict) -> dict:
-        """Edit file via read-modify-write."""
+    async def tool_edit_file(self, args: dict) -> bytes:
+        """Edit file via FILE_EDIT stream, or read-modify-write for old clients."""
         path = self.resolve_path(args.get('path', ''))
         old_string = args.get('old_string', '')
         new_string = args.get('new_string', '')
@@ -1065,32 +1574,41 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
         if not old_string:
             raise Exception("old_string is required")
 
+        old = old_string.encode('utf-8')
+        new = new_string.encode('utf-8')
+
+        if self.client_can_edit:
+            metadata = (encode_string(path) +
+                        struct.pack('>BI', EDIT_REPLACE_ALL if replace_all else 0, len(old)) + old +
+                        struct.pack('>I', len(new)) + new)
+            # Oversized edits don't fit in one STREAM_OPEN; fall through
+            if 5 + len(metadata) <= CLIENT_MAX_PACKET:
+                stream_id = await self.open_stream(STREAM_FILE_EDIT, metadata)
+                status, extra = await self.wait_stream(stream_id)
+                self.get_stream_data(stream_id)
+                if status != STATUS_OK or len(extra) < 4:
+                    raise Exception("Failed to edit file")
+                count = UINT32.unpack_from(extra)[0]
+                return self.edit_result(path, count, replace_all)
+
         stream_id = await self.open_stream(STREAM_FILE_READ, encode_string(path))
         status, _ = await self.wait_stream(stream_id)
         if status != STATUS_OK:
             raise Exception("Failed to read file")
 
-        content = self.get_stream_data(stream_id).decode('utf-8', errors='replace')
+        # Edit the raw bytes; decoding would mangle invalid UTF-8 elsewhere in the file
+        content = self.get_stream_data(stream_id)
 
-        count = content.count(old_string)
-        if count == 0:
-            raise Exception("old_string not found in file")
-        if count > 1 and not replace_all:
-            raise Exception(f"old_string found {count} times. Use replace_all=true or provide more context.")
+        count = content.count(old)
+        if count == 0 or (count > 1 and not replace_all):
+            return self.edit_result(path, count, replace_all)
 
-        if replace_all:
-            new_content = content.replace(old_string, new_string)
-        else:
-            new_content = content.replace(old_string, new_string, 1)
+        data = content.replace(old, new, -1 if replace_all else 1)
 
         metadata = encode_string(path) + struct.pack('>H', 0o644)
         stream_id = await self.open_stream(STREAM_FILE_WRITE, metadata)
 
-        data = new_content.encode('utf-8')
-        for i in range(0, len(data), CHUNK_SIZE):
-            chunk = data[i:i + CHUNK_SIZE]
-            payload = struct.pack('>I', stream_id) + chunk
-            await self.send_packet(PKT_STREAM_DATA, payload)
+        await self.send_stream_data(stream_id, data)
 
         payload = struct.pack('>IB', stream_id, STATUS_OK)
         await self.send_packet(PKT_STREAM_END, payload)
@@ -1099,6 +1617,15 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
         if status != STATUS_OK:
             raise Exception("Failed to write file")
 
+        return self.edit_result(path, count, replace_all)
+
+    def edit_result(self, path: str, count: int, replace_all: bool) -> bytes:
+        """Report an edit given how many times old_string occurred."""
+        if count == 0:
+            raise Exception("old_string not found in file")
+        if count > 1 and not replace_all:
+            raise Exception(f"old_string found {count} times. Use replace_all=true or provide more context.")
+
         msg = f"Replaced {count} occurrence(s)" if replace_all else "Edit successful"
         return self.tool_success(f"{msg} in {path}")
 
@@ -1106,9 +1633,14 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
     # Tool: list_directory
     # -------------------------------------------------------------------------
 
-    async def tool_list_directory(self, args: dict) -> dict:
+    async def tool_list_directory(self, args: dict) -> bytes:
         """List directory via DIR_LIST stream."""
         path = self.resolve_path(args.get('path', '.'))
+        key = ('list_directory', path)
+        cached = self.fs_cache_get(key)
+        if cached is not None:
+            return cached
+        generation = self.fs_cache_generation
 
         stream_id = await self.open_stream(STREAM_DIR_LIST, encode_string(path))
         status, _ = await self.wait_stream(stream_id)
@@ -1123,28 +1655,31 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
         while offset < len(data):
             if offset + 17 > len(data):
                 break
-            entry_type = chr(data[offset])
-            size = struct.unpack('>Q', data[offset+1:offset+9])[0]
-            mtime = struct.unpack('>Q', data[offset+9:offset+17])[0]
-            name, new_offset = decode_string(data, offset + 17)
-            offset = new_offset
+            # type(1) + size(8) + mtime(8) + name; only type and name are shown
+            type_char = DIR_ENTRY_SUFFIX.get(data[offset], '')
+            name, offset = decode_string(data, offset + 17)
+            entries.append(name + type_char)
 
-            type_char = '/' if entry_type == 'd' else '@' if entry_type == 'l' else ''
-            entries.append(f"{name}{type_char}")
-
-        return self.tool_success('\n'.join(entries) if entries else "(empty directory)")
+        result = self.tool_success('\n'.join(entries) if entries else "(empty directory)")
+        return self.fs_cache_put(key, generation, result)
 
     # -------------------------------------------------------------------------
     # Tool: file_info
     # -------------------------------------------------------------------------
 
-    async def tool_file_info(self, args: dict) -> dict:
+    async def tool_file_info(self, args: dict) -> bytes:
         """Get file info via FILE_STAT stream."""
         path = self.resolve_path(args.get('path', ''))
 
         if not path:
             raise Exception("path is required")
 
+        key = ('file_info', path)
+        cached = self.fs_cache_get(key)
+        if cached is not None:
+            return cached
+        generation = self.fs_cache_generation
+
         stream_id = await self.open_stream(STREAM_FILE_STAT, encode_string(path))
         status, _ = await self.wait_stream(stream_id)
 
@@ -1153,29 +1688,24 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
 
         data = self.get_stream_data(stream_id)
 
-        if len(data) < 22:
+        if len(data) < FILE_STAT.size:
             raise Exception("Invalid stat response")
 
-        exists = data[0]
+        exists, ftype, mode, size, mtime = FILE_STAT.unpack_from(data)
         if not exists:
-            return self.tool_success("File does not exist")
+            return self.fs_cache_put(key, generation, self.tool_success("File does not exist"))
 
-        ftype = chr(data[1])
-        mode = struct.unpack('>I', data[2:6])[0]
-        size = struct.unpack('>Q', data[6:14])[0]
-        mtime = struct.unpack('>Q', data[14:22])[0]
-
-        type_str = {'f': 'file', 'd': 'directory', 'l': 'symlink'}.get(ftype, 'other')
-        import datetime
+        type_str = FILE_TYPE_NAMES.get(ftype, 'other')
         mtime_str = datetime.datetime.fromtimestamp(mtime).isoformat()
 
-        return self.tool_success(f"Type: {type_str}\nSize: {size} bytes\nModified: {mtime_str}\nMode: {oct(mode)}")
+        result = self.tool_success(f"Type: {type_str}\nSize: {size} bytes\nModified: {mtime_str}\nMode: {oct(mode)}")
+        return self.fs_cache_put(key, generation, result)
 
     # -------------------------------------------------------------------------
     # Tool: file_exists
     # -------------------------------------------------------------------------
 
-    async def tool_file_exists(self, args: dict) -> dict:
+    async def tool_file_exists(self, args: dict) -> bytes:
         """Check file existence via FILE_EXISTS stream."""
         path = self.resolve_path(args.get('path', ''))
 
@@ -1194,7 +1724,7 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
     # Tool: search_files
     # -------------------------------------------------------------------------
 
-    async def tool_search_files(self, args: dict) -> dict:
+    async def tool_search_files(self, args: dict) -> bytes:
         """Search files via FILE_SEARCH stream."""
         pattern = args.get('pattern', '')
         path = self.resolve_path(args.get('path', '.'))
@@ -1215,23 +1745,31 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
 
         data = self.get_stream_data(stream_id)
 
+        # Each match is line_num(4) + path + line, both NUL-terminated; format
+        # the raw bytes and decode the whole result once
         matches = []
         offset = 0
-        while offset < len(data):
-            if offset + 4 > len(data):
-                break
-            line_num = struct.unpack('>I', data[offset:offset+4])[0]
-            fpath, offset = decode_string(data, offset + 4)
-            line, offset = decode_string(data, offset)
-            matches.append(f"{fpath}:{line_num}: {line}")
-
-        return self.tool_success('\n'.join(matches) if matches else "No matches found")
+        end = len(data)
+        while offset + 4 <= end:
+            line_num = UINT32.unpack_from(data, offset)[0]
+            path_end = data.find(b'\0', offset + 4)
+            if path_end < 0:
+                path_end = end
+            line_end = data.find(b'\0', path_end + 1)
+            if line_end < 0:
+                line_end = end
+            matches.append(b'%s:%d: %s' % (data[offset+4:path_end], line_num, data[path_end+1:line_end]))
+            offset = line_end + 1
+
+        if not matches:
+            return self.tool_success("No matches found")
+        return self.tool_success(b'\n'.join(matches).decode('utf-8', errors='replace'))
 
     # -------------------------------------------------------------------------
     # Tool: find_files
     # -------------------------------------------------------------------------
 
-    async def tool_find_files(self, args: dict) -> dict:
+    async def tool_find_files(self, args: dict) -> bytes:
         """Find files via FILE_FIND stream."""
         pattern = args.get('pattern', '')
         path = self.resolve_path(args.get('path', '.'))
@@ -1248,27 +1786,23 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
 
         data = self.get_stream_data(stream_id)
 
-        paths = []
-        offset = 0
-        while offset < len(data):
-            fpath, offset = decode_string(data, offset)
-            if fpath:
-                paths.append(fpath)
+        # Paths arrive NUL-terminated; split the whole buffer in one pass
+        paths = '\n'.join(filter(None, data.decode('utf-8', errors='replace').split('\0')))
 
-        return self.tool_success('\n'.join(paths) if paths else "No files found")
+        return self.tool_success(paths or "No files found")
 
     # -------------------------------------------------------------------------
     # Tool: execute_command
     # -------------------------------------------------------------------------
 
-    async def tool_execute_command(self, args: dict) -> dict:
+    async def tool_execute_command(self, args: dict) -> bytes:
         """Execute command via EXEC stream."""
         command = args.get('command', '')
 
         if not command:
             raise Exception("command is required")
 
-        stream_id = await self.open_stream(STREAM_EXEC, encode_string(command))
+        stream_id = await self.open_stream(STREAM_EXEC, encode_string(command), chunked=True)
         status, extra = await self.wait_stream(stream_id)
 
         if status != STATUS_OK:
@@ -1276,7 +1810,7 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
 
         exit_code = 0
         if len(extra) >= 4:
-            exit_code = struct.unpack('>i', extra[:4])[0]
+            exit_code = INT32.unpack_from(extra)[0]
 
         chunks = self.get_stream_chunks(stream_id)
 
@@ -1287,7 +1821,7 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
             if len(chunk) < 1:
                 continue
             channel = chunk[0]
-            data = chunk[1:]
+            data = memoryview(chunk)[1:]
             if channel == 0x01:
                 stdout_parts.append(data)
             elif channel == 0x02:
@@ -1312,7 +1846,7 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
     # Tool: make_directory
     # -------------------------------------------------------------------------
 
-    async def tool_make_directory(self, args: dict) -> dict:
+    async def tool_make_directory(self, args: dict) -> bytes:
         """Create directory via MKDIR stream."""
         path = self.resolve_path(args.get('path', ''))
 
@@ -1331,7 +1865,7 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
     # Tool: remove_file
     # -------------------------------------------------------------------------
 
-    async def tool_remove_file(self, args: dict) -> dict:
+    async def tool_remove_file(self, args: dict) -> bytes:
         """Remove file via REMOVE stream."""
         path = self.resolve_path(args.get('path', ''))
 
@@ -1350,7 +1884,7 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
     # Tool: move_file
     # -------------------------------------------------------------------------
 
-    async def tool_move_file(self, args: dict) -> dict:
+    async def tool_move_file(self, args: dict) -> bytes:
         """Move file via MOVE stream."""
         source = self.resolve_path(args.get('source', ''))
         dest = self.resolve_path(args.get('destination', ''))
@@ -1371,21 +1905,17 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
     # Tool: download_url
     # -------------------------------------------------------------------------
 
-    async def tool_download_url(self, args: dict) -> dict:
+    async def tool_download_url(self, args: dict) -> bytes:
         """Download URL and write to remote.
 
         Relative paths are saved to /tmp to avoid cluttering working directory.
         Use absolute path to save elsewhere.
         """
-        import urllib.request
-        import urllib.error
-
         url = args.get('url', '')
         raw_path = args.get('path', '')
 
         # Relative paths go to /tmp, absolute paths used as-is
         if raw_path and not raw_path.startswith('/'):
-            import posixpath
             path = posixpath.join('/tmp', raw_path)
         else:
             path = raw_path
@@ -1395,38 +1925,64 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
         if not path:
             raise Exception("path is required")
 
+        # urlopen and read block, so they run in the default executor while
+        # the body is forwarded to the client one chunk at a time
         try:
             req = urllib.request.Request(url, headers={'User-Agent': 'claude-telepresence/2.0'})
-            with urllib.request.urlopen(req, timeout=60) as resp:
-                content = resp.read()
-                content_type = resp.headers.get('Content-Type', 'unknown')
+            resp = await self.loop.run_in_executor(
+                None, functools.partial(urllib.request.urlopen, req, timeout=60))
         except urllib.error.HTTPError as e:
             raise Exception(f"HTTP error {e.code}: {e.reason}")
         except urllib.error.URLError as e:
             raise Exception(f"URL error: {e.reason}")
 
-        metadata = encode_string(path) + struct.pack('>H', 0o644)
-        stream_id = await self.open_stream(STREAM_FILE_WRITE, metadata)
-
-        for i in range(0, len(content), CHUNK_SIZE):
-            chunk = content[i:i + CHUNK_SIZE]
-            payload = struct.pack('>I', stream_id) + chunk
-            await self.send_packet(PKT_STREAM_DATA, payload)
+        # The body goes to a temporary file next to the destination, which
+        # only replaces it once the whole download arrived
+        temp_path = f"{path}.{secrets.token_hex(4)}.part"
+        try:
+            content_type = resp.headers.get('Content-Type', 'unknown')
+            metadata = encode_string(temp_path) + struct.pack('>H', 0o644)
+            if self.client_can_write_excl:
+                metadata += bytes([WRITE_EXCLUSIVE])
+            stream_id = await self.open_stream(STREAM_FILE_WRITE, metadata)
+            future = self.stream_future(stream_id)
+            if future is None:
+                raise Exception("Stream closed")
+            total = 0
+
+            # Stop reading once the client has failed the stream; its error
+            # is reported by wait_stream below
+            while not future.done():
+                try:
+                    chunk = await self.loop.run_in_executor(None, resp.read, CHUNK_SIZE)
+                    # Sized reads return b'' rather than raising on a short body
+                    if not chunk and getattr(resp, 'length', None):
+                        raise Exception(f"connection closed, {resp.length} bytes missing")
+                except Exception as e:
+                    await self.abort_remote_write(stream_id, temp_path)
+                    raise Exception(f"Download failed after {total} bytes: {e}")
+                if not chunk:
+                    break
+                total += len(chunk)
+                await self.send_stream_data(stream_id, chunk)
+        finally:
+            resp.close()
 
-        payload = struct.pack('>IB', stream_id, STATUS_OK)
-        await self.send_packet(PKT_STREAM_END, payload)
+        if not future.done():
+            payload = struct.pack('>IB', stream_id, STATUS_OK)
+            await self.send_packet(PKT_STREAM_END, payload)
 
-        status, _ = await self.wait_stream(stream_id)
+        status = await self.install_remote_file(stream_id, temp_path, path)
         if status != STATUS_OK:
             raise Exception("Failed to write downloaded file")
 
-        return self.tool_success(f"Downloaded {len(content)} bytes from {url}\nSaved to: {path}\nContent-Type: {content_type}")
+        return self.tool_success(f"Downloaded {total} bytes from {url}\nSaved to: {path}\nContent-Type: {content_type}")
 
     # -------------------------------------------------------------------------
     # Tool: upload_to_host
     # -------------------------------------------------------------------------
 
-    async def tool_upload_to_host(self, args: dict) -> dict:
+    async def tool_upload_to_host(self, args: dict) -> bytes:
         """Copy file from remote legacy system to Linux host."""
         remote_path = self.resolve_path(args.get('remote_path', ''))
         host_path_arg = args.get('host_path', '')
@@ -1444,32 +2000,55 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
         if os.path.exists(host_path) and not overwrite:
             raise Exception(f"Host file already exists: {host_path} (use overwrite=true to replace)")
 
-        # Read from remote
-        stream_id = await self.open_stream(STREAM_FILE_READ, encode_string(remote_path))
-        status, _ = await self.wait_stream(stream_id)
-
-        if status != STATUS_OK:
-            raise Exception(f"Failed to read remote file: {remote_path}")
-
-        content = self.get_stream_data(stream_id)
-
-        # Write to host
+        # Stream the remote file into a temporary file next to the
+        # destination, which only replaces it once the whole file arrived
+        temp_path = f"{host_path}.{secrets.token_hex(4)}.part"
         try:
             parent_dir = os.path.dirname(host_path)
             if parent_dir:
                 os.makedirs(parent_dir, exist_ok=True)
-            with open(host_path, 'wb') as f:
-                f.write(content)
+            f = open(temp_path, 'xb')
         except OSError as e:
             raise Exception(f"Failed to write host file: {e}")
 
-        return self.tool_success(f"Uploaded {len(content)} bytes\nFrom remote: {remote_path}\nTo host: {host_path}")
+        try:
+            with f:
+                # File writes run in the executor, off the event loop
+                sink = FileSink(self.loop, f)
+                try:
+                    stream_id = await self.open_stream(STREAM_FILE_READ, encode_string(remote_path), sink=sink)
+                    try:
+                        status, _ = await self.wait_stream(stream_id)
+                    except Exception:
+                        # Stop the client reading; never mask the real error
+                        if self.client_connected.is_set():
+                            try:
+                                await self.send_packet(PKT_STREAM_CANCEL, UINT32.pack(stream_id))
+                            except Exception:
+                                pass
+                        raise
+                finally:
+                    await sink.close()
+                if sink.error is not None:
+                    raise Exception(f"Failed to write host file: {sink.error}")
+                if status != STATUS_OK:
+                    raise Exception(f"Failed to read remote file: {remote_path}")
+                size = f.tell()
+            os.replace(temp_path, host_path)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+
+        return self.tool_success(f"Uploaded {size} bytes\nFrom remote: {remote_path}\nTo host: {host_path}")
 
     # -------------------------------------------------------------------------
     # Tool: download_from_host
     # -------------------------------------------------------------------------
 
-    async def tool_download_from_host(self, args: dict) -> dict:
+    async def tool_download_from_host(self, args: dict) -> bytes:
         """Copy file from Linux host to remote legacy system."""
         host_path_arg = args.get('host_path', '')
         remote_path = self.resolve_path(args.get('remote_path', ''))
@@ -1483,8 +2062,9 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
         # Resolve and validate host path (restricted to relay start directory)
         host_path = self.resolve_host_path(host_path_arg)
 
-        # Check if remote destination exists
-        if not overwrite:
+        # Clients that honor WRITE_EXCLUSIVE check for an existing file when
+        # the write opens; older ones need a FILE_EXISTS round trip first
+        if not overwrite and not self.client_can_write_excl:
             stream_id = await self.open_stream(STREAM_FILE_EXISTS, encode_string(remote_path))
             await self.wait_stream(stream_id)
             data = self.get_stream_data(stream_id)
@@ -1492,38 +2072,63 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
             if exists:
                 raise Exception(f"Remote file already exists: {remote_path} (use overwrite=true to replace)")
 
-        # Read from host
         try:
-            with open(host_path, 'rb') as f:
-                content = f.read()
+            f = open(host_path, 'rb')
         except FileNotFoundError:
             raise Exception(f"Host file not found: {host_path}")
         except OSError as e:
             raise Exception(f"Failed to read host file: {e}")
 
-        # Write to remote
-        metadata = encode_string(remote_path) + struct.pack('>H', 0o644)
-        stream_id = await self.open_stream(STREAM_FILE_WRITE, metadata)
-
-        for i in range(0, len(content), CHUNK_SIZE):
-            chunk = content[i:i + CHUNK_SIZE]
-            payload = struct.pack('>I', stream_id) + chunk
-            await self.send_packet(PKT_STREAM_DATA, payload)
+        # Send the file a window at a time rather than reading it whole;
+        # reads run in the default executor so a slow disk can't stall the loop
+        # An overwrite goes to a temporary file that replaces the destination
+        # once complete; without overwrite the destination did not exist
+        write_path = f"{remote_path}.{secrets.token_hex(4)}.part" if overwrite else remote_path
+        with f:
+            metadata = encode_string(write_path) + struct.pack('>H', 0o644)
+            if self.client_can_write_excl:
+                metadata += bytes([WRITE_EXCLUSIVE])
+            stream_id = await self.open_stream(STREAM_FILE_WRITE, metadata)
+            future = self.stream_future(stream_id)
+            if future is None:
+                raise Exception("Stream closed")
+            total = 0
+
+            # Stop sending once the client has failed the stream
+            while not future.done():
+                try:
+                    chunk = await self.loop.run_in_executor(None, f.read, DEFAULT_WINDOW)
+                except OSError as e:
+                    await self.abort_remote_write(stream_id, write_path)
+                    raise Exception(f"Failed to read host file: {e}")
+                if not chunk:
+                    break
+                total += len(chunk)
+                await self.send_stream_data(stream_id, chunk)
 
-        payload = struct.pack('>IB', stream_id, STATUS_OK)
-        await self.send_packet(PKT_STREAM_END, payload)
+        if not future.done():
+            payload = struct.pack('>IB', stream_id, STATUS_OK)
+            await self.send_packet(PKT_STREAM_END, payload)
 
-        status, _ = await self.wait_stream(stream_id)
+        if overwrite:
+            status = await self.install_remote_file(stream_id, write_path, remote_path)
+        else:
+            try:
+                status, _ = await self.wait_stream(stream_id)
+            except StreamError as e:
+                if e.code == ERR_EXISTS:
+                    raise Exception(f"Remote file already exists: {remote_path} (use overwrite=true to replace)")
+                raise
         if status != STATUS_OK:
             raise Exception(f"Failed to write remote file: {remote_path}")
 
-        return self.tool_success(f"Downloaded {len(content)} bytes\nFrom host: {host_path}\nTo remote: {remote_path}")
+        return self.tool_success(f"Downloaded {total} bytes\nFrom host: {host_path}\nTo remote: {remote_path}")
 
     # -------------------------------------------------------------------------
     # Tool: list_host_directory
     # -------------------------------------------------------------------------
 
-    async def tool_list_host_directory(self, args: dict) -> dict:
+    async def tool_list_host_directory(self, args: dict) -> bytes:
         """List contents of a directory on the Linux host."""
         path_arg = args.get('path', '')
 
@@ -1578,18 +2183,30 @@ Standard Bash/Read/Write tools operate on LOCAL host only."""
                 os.kill(self.claude_pid, signal.SIGTERM)
             except ProcessLookupError:
                 pass
+            self.loop.run_in_executor(None, reap_process, self.claude_pid)
             self.claude_pid = None
 
         if self.master_fd:
+            self.loop.remove_writer(self.master_fd)
+            self.pty_outbuf.clear()
             try:
                 os.close(self.master_fd)
             except OSError:
                 pass
             self.master_fd = None
 
-        self.pending_streams.clear()
+        # Fail in-flight tool calls now rather than at their stream timeout
+        for entry in self.pending_streams:
+            if entry is not None:
+                if not entry.future.done():
+                    entry.future.set_exception(Exception("Client disconnected"))
+                    # Mark it retrieved: a stream nobody is waiting on yet
+                    # would otherwise log "Future exception was never retrieved"
+                    entry.future.exception()
+                self.release_stream(entry.id)
         self.stream_data.clear()
-        self.next_stream_id = 0
+        self.stream_ids = itertools.count(0, 2)
+        self.invalidate_fs_cache()
 
 
 # =============================================================================
@@ -1606,8 +2223,17 @@ def main():
 
     relay = RelayV2(args.host, args.port, args.mcp_port, args.claude)
 
+    # uvloop is optional; the stdlib event loop works, just slower
     try:
-        asyncio.run(relay.start())
+        if uvloop is None:
+            asyncio.run(relay.start())
+        elif hasattr(asyncio, 'Runner'):
+            with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+                runner.run(relay.start())
+        else:
+            # Before 3.11 a policy is the only way to hand asyncio.run a loop
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            asyncio.run(relay.start())
     except KeyboardInterrupt:
         print("\nShutting down...")
 